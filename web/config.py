@@ -1,4 +1,5 @@
 # 文件路径: web/config.py
+from dataclasses import dataclass
 from typing import List, Dict, Any, Tuple
 
 # === 1. 系统与爬虫配置 (System Config) ===
@@ -89,8 +90,23 @@ NUMERIC_FIELDS: List[str] = [
     "昨收", "昨涨跌幅", "昨成交量", "昨换手率", "近一周涨跌幅", "近一月涨跌幅"
 ]
 
+# 数值字符串清洗规则: 去掉千分位逗号、百分号和空格 (str.translate 表)
+# 爬虫入库、衍生指标计算、重算类型修复三处共用，保证同一原始值解析结果一致
+NUMERIC_STRIP_TRANS = str.maketrans('', '', ',% ')
+
 # === 5. 前端表格列配置 (UI Config) ===
-COLUMN_CONFIG: List[Dict[str, Any]] = [
+@dataclass(frozen=True, slots=True)
+class ColumnConfig:
+    """表格列定义 (不可变，导入时构建一次)"""
+    key: str
+    label: str
+    desc: str = ""
+    tip: str = ""
+    suffix: str = ""
+    no_sort: bool = False
+    no_chart: bool = False
+
+_RAW_COLUMN_CONFIG: List[Dict[str, Any]] = [
     {"key": "所属行业", "label": "行业", "desc": "公司所属行业板块", "tip": "按东财/GICS分类标准划分", "no_sort": True, "no_chart": True},
     {"key": "bull_label", "label": "长牛评级", "desc": "长牛分级筛选", "tip": "基于5年走势算法筛选。<br>需满足：<br>1. R²>0.8<br>2. 年化10%-60%<br>3. <b>日均成交 > 500万</b><br>4. <b>ROE > 0</b>", "no_chart": True},
     {"key": "trend_analysis.r_squared", "label": "趋势R²", "desc": "对应周期的拟合度", "tip": "股价走势越接近直线，该值越接近1。<br><b>>0.8</b> 表示极度平稳。", "no_chart": True},
@@ -176,4 +192,6 @@ COLUMN_CONFIG: List[Dict[str, Any]] = [
     {"key": "已发行股本(股)", "label": "发行股本", "desc": "", "tip": "", "no_sort": True, "no_chart": True},
     {"key": "已发行股本-H股(股)", "label": "H股股本", "desc": "", "tip": "", "no_sort": True, "no_chart": True},
     {"key": "每手股", "label": "每手股", "desc": "", "tip": "", "no_sort": True, "no_chart": True},
-]
\ No newline at end of file
+]
+
+COLUMN_CONFIG: Tuple[ColumnConfig, ...] = tuple(ColumnConfig(**c) for c in _RAW_COLUMN_CONFIG)
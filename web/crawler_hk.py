@@ -1,6 +1,7 @@
 # 文件路径: web/crawler_hk.py
 import akshare as ak
 import pandas as pd
+import numpy as np
 import asyncio
 import functools
 import aiohttp
@@ -12,9 +13,10 @@ from datetime import datetime
 from pymongo import UpdateOne
 from database import stock_collection
 from crawler_state import status
-from config import NUMERIC_FIELDS, SystemConfig
+from config import NUMERIC_FIELDS, NUMERIC_STRIP_TRANS, SystemConfig
 from logger import crawl_logger as logger
 
+
 # === 线程池配置 ===
 # 使用配置中的线程数
 EXECUTOR = ThreadPoolExecutor(max_workers=SystemConfig.CRAWLER_MAX_WORKERS)
@@ -151,6 +153,38 @@ def compute_market_performance(df: pd.DataFrame, h_share_capital: float = 0.0) -
         pass
     return performance
 
+def _numeric_column(df: pd.DataFrame, keys: List[str]) -> np.ndarray:
+    """按候选列名逐行取第一个可解析的数值，缺失为 NaN"""
+    result = np.full(len(df), np.nan)
+    for k in keys:
+        if k not in df.columns: continue
+        vals = pd.to_numeric(df[k].astype(str).str.translate(NUMERIC_STRIP_TRANS), errors='coerce').to_numpy(dtype=np.float64)
+        result = np.where(np.isnan(result), vals, result)
+    return result
+
+def compute_row_derived(df: pd.DataFrame) -> Dict[str, Tuple[np.ndarray, int]]:
+    """
+    对整张财务表向量化计算基础衍生指标 (PEG/PEGY/合理股价/净现比)。
+    返回 {字段: (逐行数值, 保留小数位)}，不满足条件的行为 NaN。
+    """
+    pe = _numeric_column(df, ['市盈率', 'PE'])
+    eps = _numeric_column(df, ['基本每股收益(元)', '基本每股收益'])
+    growth = _numeric_column(df, ['净利润滚动环比增长(%)', '净利润环比增长'])
+    div_yield = _numeric_column(df, ['股息率TTM(%)', '股息率'])
+    ocf_ps = _numeric_column(df, ['每股经营现金流(元)', '每股经营现金流'])
+
+    derived: Dict[str, Tuple[np.ndarray, int]] = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 数据源自带 PEG 时不覆盖
+        if "PEG" not in df.columns:
+            derived['PEG'] = (np.where((pe > 0) & (growth != 0), pe / growth, np.nan), 4)
+        tr = growth + div_yield
+        derived['PEGY'] = (np.where((pe > 0) & (tr > 0), pe / tr, np.nan), 4)
+        fp = eps * (8.5 + 2 * growth)
+        derived['合理股价'] = (np.where(fp > 0, fp, np.nan), 2)
+        derived['净现比'] = (np.where((eps > 0) & (ocf_ps != 0), ocf_ps / eps, np.nan), 2)
+    return derived
+
 async def fetch_single_stock_op_async(code: str, name: str, is_ggt: Optional[bool] = None) -> Optional[UpdateOne]:
     """核心爬虫逻辑"""
     if status.should_stop: return None
@@ -289,6 +323,9 @@ async def fetch_single_stock_op_async(code: str, name: str, is_ggt: Optional[boo
             except Exception as e:
                 logger.warning(f"[{code}] QFQ历史数据清洗失败: {e}")
 
+        # 衍生指标整表向量化计算，逐行循环中只做取值
+        row_derived = compute_row_derived(df)
+
         # === 数据库操作构建 ===
         def prepare_db_op():
             existing_doc = stock_collection.find_one({"_id": code})
@@ -296,7 +333,7 @@ async def fetch_single_stock_op_async(code: str, name: str, is_ggt: Optional[boo
             final_is_ggt = is_ggt if is_ggt is not None else existing_doc.get("is_ggt", False) if existing_doc else False
             
             latest_record = {}
-            for _, row in df.iterrows():
+            for pos, (_, row) in enumerate(df.iterrows()):
                 row_date = row['date']
                 new_data = row.to_dict()
                 
@@ -305,11 +342,14 @@ async def fetch_single_stock_op_async(code: str, name: str, is_ggt: Optional[boo
                     should_convert = (k in NUMERIC_FIELDS)
                     clean_val = v
                     if should_convert:
-                        try: clean_val = float(str(v).replace(',', ''))
-                        except: clean_val = v
+                        # 快速路径: 已是数值 (含 numpy 浮点) 时直接转换，避免 str 往返
+                        if isinstance(v, float): clean_val = float(v)
+                        else:
+                            try: clean_val = float(str(v).translate(NUMERIC_STRIP_TRANS))
+                            except: clean_val = v
                     else:
                         if isinstance(v, str) and "-" not in v and ":" not in v:
-                             try: clean_val = float(v.replace(',', ''))
+                             try: clean_val = float(v.translate(NUMERIC_STRIP_TRANS))
                              except: pass
                     new_data[k] = clean_val
                 
@@ -317,26 +357,9 @@ async def fetch_single_stock_op_async(code: str, name: str, is_ggt: Optional[boo
                 if intro_val: new_data['企业简介'] = intro_val
                 new_data["date"] = row_date
 
-                def get_v(keys):
-                    for k in keys:
-                        if k in new_data and isinstance(new_data[k], (int, float)): return new_data[k]
-                    return None
-                pe = get_v(['市盈率','PE'])
-                eps = get_v(['基本每股收益(元)','基本每股收益'])
-                growth = get_v(['净利润滚动环比增长(%)','净利润环比增长'])
-                div_yield = get_v(['股息率TTM(%)','股息率'])
-                ocf_ps = get_v(['每股经营现金流(元)','每股经营现金流'])
-                
-                if "PEG" not in new_data and pe and pe > 0 and growth and growth != 0: 
-                    new_data['PEG'] = round(pe / growth, 4)
-                if pe and pe > 0 and growth is not None and div_yield is not None:
-                    tr = growth + div_yield
-                    if tr > 0: new_data['PEGY'] = round(pe / tr, 4)
-                if growth is not None and eps is not None:
-                    fp = eps * (8.5 + 2 * growth)
-                    if fp > 0: new_data['合理股价'] = round(fp, 2)
-                if ocf_ps and eps and eps > 0: 
-                    new_data['净现比'] = round(ocf_ps / eps, 2)
+                for field, (values, ndigits) in row_derived.items():
+                    val = values[pos]
+                    if val == val: new_data[field] = round(float(val), ndigits)
 
                 if row_date in history_map: history_map[row_date].update(new_data)
                 else: history_map[row_date] = new_data
@@ -355,7 +378,8 @@ async def fetch_single_stock_op_async(code: str, name: str, is_ggt: Optional[boo
             }
             if qfq_records: update_fields["qfq_history"] = qfq_records
 
-            op = UpdateOne({"_id": code}, {"$set": update_fields}, upsert=True)
+            # history 已整体重写，清除衍生指标版本，下次重算时重新计算
+            op = UpdateOne({"_id": code}, {"$set": update_fields, "$unset": {"derived_version": ""}}, upsert=True)
             return op
 
         op = await async_db_call(prepare_db_op)
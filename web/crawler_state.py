@@ -1,4 +1,6 @@
 # 文件路径: web/crawler_state.py
+import time
+import orjson
 from datetime import datetime
 from typing import Optional
 
@@ -14,6 +16,12 @@ class CrawlerStatus:
         self.total: int = 0
         self.message: str = "空闲"
         self.last_finished_time: Optional[datetime] = None
+        # 进度上报节流状态
+        self._last_report_count: int = 0
+        self._last_report_time: float = 0.0
+        # /api/status 的序列化快照 (状态未变时直接复用)
+        self._snapshot_key: Optional[tuple] = None
+        self._snapshot_json: bytes = b""
 
     def start(self, total: int):
         """重置状态，开始新任务"""
@@ -22,18 +30,48 @@ class CrawlerStatus:
         self.total = total
         self.current = 0
         self.message = "正在初始化..."
+        self._last_report_count = 0
+        self._last_report_time = time.monotonic()
 
     def request_stop(self):
         """发出停止请求 (软中断)"""
         self.should_stop = True
         self.message = "正在停止..."
 
+    def should_report(self, current: int, every: int = 25, interval: float = 0.1) -> bool:
+        """
+        进度上报节流: 距上次上报已处理 every 条或超过 interval 秒时返回 True。
+        调用方据此决定是否拼接消息并调用 update，避免逐条格式化字符串。
+        """
+        now = time.monotonic()
+        if current - self._last_report_count >= every or now - self._last_report_time >= interval:
+            self._last_report_count = current
+            self._last_report_time = now
+            return True
+        return False
+
     def update(self, current: int, message: str = ""):
         """更新进度"""
         self.current = current
         if message:
             self.message = message
 
+    def snapshot_json(self) -> bytes:
+        """
+        返回当前状态的 JSON 字节串。
+        以字段值作为缓存键，其他模块直接改写 message 等字段时也能及时刷新。
+        """
+        key = (self.is_running, self.current, self.total, self.message)
+        if key != self._snapshot_key:
+            self._snapshot_json = orjson.dumps({
+                "is_running": key[0],
+                "current": key[1],
+                "total": key[2],
+                "message": key[3]
+            })
+            self._snapshot_key = key
+        return self._snapshot_json
+
     def finish(self, end_msg: str = "任务完成"):
         """标记任务结束"""
         self.is_running = False
@@ -1,10 +1,12 @@
 # 文件路径: web/database.py
 import os
 import multiprocessing # [新增]
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, AsyncMongoClient, ASCENDING, DESCENDING
 from pymongo.collection import Collection
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 from pymongo.database import Database
-from typing import Optional
+from pymongo.asynchronous.collection import AsyncCollection
+from typing import Optional, Dict, Any
 
 # === 配置区域 ===
 # 小白注释: os.getenv 尝试从环境变量获取配置，如果没获取到就用后面的默认值
@@ -20,6 +22,17 @@ if MONGO_USER:
 else:
     MONGO_URI = f"mongodb://{MONGO_HOST}:{MONGO_PORT}/"
 
+# 连接池配置: 同一进程内复用连接，保持少量常驻连接避免每次查询重新握手
+# 网络压缩: 默认 zlib (标准库自带)；安装 zstandard 后可设置 MONGO_COMPRESSORS=zstd,zlib
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+MONGO_POOL_OPTIONS: Dict[str, Any] = {"maxPoolSize": 50, "minPoolSize": 10}
+if MONGO_COMPRESSORS:
+    MONGO_POOL_OPTIONS["compressors"] = MONGO_COMPRESSORS
+# 读偏好: 部署为副本集时可设置 MONGO_READ_PREFERENCE=secondaryPreferred，把查询分流到从节点
+# 只作用于异步 stocks 集合 (API 只读查询，读到稍旧的数据无害)；
+# 同步客户端承担"先读后写"的任务 (爬虫合并 history、重算按下标回写)，必须始终读主节点
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "")
+
 # 全局变量定义
 client: Optional[MongoClient] = None
 db: Optional[Database] = None
@@ -27,18 +40,36 @@ stock_collection: Optional[Collection] = None
 config_collection: Optional[Collection] = None
 template_collection: Optional[Collection] = None
 
+# 异步客户端: 供 FastAPI 的 async 路由使用，避免同步查询阻塞事件循环
+# (后台任务/调度器运行在线程中，继续使用上面的同步客户端)
+async_client: Optional[AsyncMongoClient] = None
+async_stock_collection: Optional[AsyncCollection] = None
+async_config_collection: Optional[AsyncCollection] = None
+async_template_collection: Optional[AsyncCollection] = None
+
 def init_db():
     """初始化数据库连接及索引"""
     global client, db, stock_collection, config_collection, template_collection
+    global async_client, async_stock_collection, async_config_collection, async_template_collection
     try:
         # connect=False: 避免在 import 时立即连接，防止多进程 fork 时死锁
-        client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, connect=False)
+        client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, connect=False, **MONGO_POOL_OPTIONS)
         
         db = client[DB_NAME]
         stock_collection = db["stocks"]
         config_collection = db["system_config"] 
         template_collection = db["filter_templates"]
 
+        async_client = AsyncMongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, connect=False, **MONGO_POOL_OPTIONS)
+        async_db = async_client[DB_NAME]
+        if MONGO_READ_PREFERENCE:
+            read_pref = make_read_preference(read_pref_mode_from_name(MONGO_READ_PREFERENCE), None)
+            async_stock_collection = async_db.get_collection("stocks", read_preference=read_pref)
+        else:
+            async_stock_collection = async_db["stocks"]
+        async_config_collection = async_db["system_config"]
+        async_template_collection = async_db["filter_templates"]
+
         # === [修改] 仅主进程建立索引 ===
         # 子进程(Worker)不需要重复建立索引，这能减少数据库启动时的压力
         if multiprocessing.current_process().name == 'MainProcess':
@@ -57,10 +88,27 @@ def init_db():
                 "latest_data.股息率TTM(%)",
                 "latest_data.股东权益回报率(%)",
                 "latest_data.所属行业",
-                "trend_analysis.r_squared"
+                "latest_data.昨涨跌幅",
+                "latest_data.昨换手率",
+                "latest_data.总市值(港元)",
+                "trend_analysis.r_squared",
+                "ma_strategy.total_return"
             ]
             for field in index_fields:
                 stock_collection.create_index([(field, ASCENDING)], background=True)
+
+            # 长牛评级筛选后按市盈率排序 (常用组合): 复合索引可按序读取，避免内存排序
+            stock_collection.create_index([("bull_label", ASCENDING), ("latest_data.市盈率", ASCENDING)], background=True)
+
+            # 首页"最后更新时间"按 updated_at 倒序取一条
+            stock_collection.create_index([("updated_at", DESCENDING)], background=True)
+            # 爬虫新鲜度检查按 latest_data.date 排序并计数
+            stock_collection.create_index([("latest_data.date", DESCENDING)], background=True)
+            # 重算任务只扫描衍生指标版本落后的文档
+            stock_collection.create_index([("derived_version", ASCENDING)], background=True)
+
+            # 模版列表按名称排序返回，建立索引避免内存排序
+            template_collection.create_index([("name", ASCENDING)], background=True)
         # ============================
             
     except Exception as e:
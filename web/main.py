@@ -1,22 +1,33 @@
 # 文件路径: web/main.py
 import uvicorn
+import asyncio
 import importlib
 import os
+import re
+import json
+import orjson
+from functools import lru_cache
 import time
-from fastapi import FastAPI, Request, BackgroundTasks, Body
+from concurrent.futures import Future, ThreadPoolExecutor
+from fastapi import FastAPI, Request, BackgroundTasks, Body, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from jinja2 import FileSystemBytecodeCache
+from jinja2.utils import htmlsafe_json_dumps
+from markupsafe import Markup
+from fastapi.responses import HTMLResponse, Response, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from dataclasses import asdict
 from datetime import datetime
 from tzlocal import get_localzone 
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from pydantic import BaseModel, Field 
 
 # 引入项目模块
-from database import stock_collection, config_collection, template_collection
+from database import stock_collection
+from database import async_client, async_stock_collection, async_config_collection, async_template_collection
 import crawler_hk as crawler
 from crawler_state import status 
 from services.analysis_service import AnalysisService
@@ -51,7 +62,10 @@ class TemplateRequest(BaseModel):
     filters: Dict[str, Any]
 
 # === 初始化服务 ===
-scheduler = BackgroundScheduler(timezone=str(get_localzone()))
+# 调度器在 lifespan 启动时创建，避免模块被重复 import 时产生多个调度器
+scheduler: Optional[BackgroundScheduler] = None
+# 本地时区在进程启动时解析一次，调度器与定时任务共用
+LOCAL_TZ = str(get_localzone())
 analysis_service = AnalysisService(stock_collection, status)
 maintenance_service = MaintenanceService(stock_collection, status) 
 
@@ -63,7 +77,47 @@ DEFAULT_SCHEDULE = {
     "minute": 0
 }
 
+# 前端表格实际使用的列 (导入时计算一次，查询时只拷贝这些 latest_data 字段)
+_COLUMN_KEYS: Tuple[str, ...] = tuple(col.key for col in COLUMN_CONFIG)
+_LATEST_COLUMN_KEYS: Tuple[str, ...] = tuple(
+    k for k in _COLUMN_KEYS
+    if k != "bull_label" and not k.startswith(("trend_analysis.", "ma_strategy."))
+)
+
+# 表格列的空值模版 (缺失的列统一为 None)
+_EMPTY_LATEST_ROW: Dict[str, Any] = dict.fromkeys(_LATEST_COLUMN_KEYS)
+
+# 股票列表查询的服务端投影: 只取表格需要的字段，避免传输 history/qfq_history 等大字段
+_QUERY_PROJECTION: Dict[str, int] = {
+    "name": 1, "intro": 1, "is_ggt": 1, "bull_label": 1, "trend_analysis": 1,
+    "ma_strategy.total_return": 1, "ma_strategy.benchmark_return": 1,
+    "ma_strategy.params": 1, "ma_strategy.metrics": 1,
+    "latest_data.date": 1, "latest_data.企业简介": 1,
+    **{f"latest_data.{k}": 1 for k in _LATEST_COLUMN_KEYS}
+}
+
+# 供前端脚本使用的列定义 (window.g_columns)，导入时序列化一次
+# 与 Jinja 的 tojson 过滤器一致: HTML 安全转义 + 键排序，渲染时无需再编码
+_COLUMNS_JSON: Markup = htmlsafe_json_dumps([asdict(col) for col in COLUMN_CONFIG], sort_keys=True)
+
+# 首页 HTML 缓存: 数据只在任务结束 (status.finish) 后变化，以 last_finished_time 作为版本号
+_index_page_cache: Dict[str, Any] = {"key": None, "html": None}
+_BOOT_TAG = f"boot-{int(time.time())}"
+
+# 模版列表缓存 (模版很少变动，仅在保存/删除时失效)
+_templates_cache: Optional[List[Dict[str, Any]]] = None
+
+# 定时配置缓存 (仅在 set_schedule 时失效)
+_schedule_cache: Optional[Dict[str, Any]] = None
+
+# 模版/定时配置的版本号，写入时递增，用于生成 ETag
+_templates_version = 0
+_schedule_version = 0
+
 # === 任务与调度 ===
+# 开发模式: 每次任务前重新加载爬虫模块 (设置 CRAWLER_HOT_RELOAD=1 开启)
+CRAWLER_HOT_RELOAD = os.getenv("CRAWLER_HOT_RELOAD", "0") == "1"
+
 def dynamic_task_wrapper(force_update: bool = True):
     """
     全自动任务流: 爬虫 -> 分析 -> 策略 -> 通知
@@ -75,8 +129,9 @@ def dynamic_task_wrapper(force_update: bool = True):
     if not status.is_running:
         try:
             logger.info(f"🔄 任务阶段 1/4: 启动爬虫 (强制模式: {force_update})...")
-            # reload 确保代码修改后不用重启也能生效 (开发模式用)
-            importlib.reload(crawler)
+            # reload 确保代码修改后不用重启也能生效 (仅开发模式；生产环境复用已加载的模块及其线程池)
+            if CRAWLER_HOT_RELOAD:
+                importlib.reload(crawler)
             
             # 传递 force_update 参数给爬虫模块
             crawler.run_crawler_task(force_update=force_update)
@@ -118,62 +173,245 @@ def update_scheduler_job(config: dict):
         minute = config.get('minute', 0)
         sched_type = config.get('type', 'daily')
         day_of_week = config.get('day_of_week', '5')
-        local_tz = str(get_localzone())
 
-        if scheduler.get_job('crawler_job'):
-            scheduler.remove_job('crawler_job')
-        
         if sched_type == 'weekly':
-            trigger = CronTrigger(day_of_week=int(day_of_week), hour=hour, minute=minute, timezone=local_tz)
+            trigger = CronTrigger(day_of_week=int(day_of_week), hour=hour, minute=minute, timezone=LOCAL_TZ)
         else:
-            trigger = CronTrigger(hour=hour, minute=minute, timezone=local_tz)
+            trigger = CronTrigger(hour=hour, minute=minute, timezone=LOCAL_TZ)
 
         # 定时任务默认使用强制更新模式 (force_update=True)
-        scheduler.add_job(dynamic_task_wrapper, trigger, id='crawler_job', kwargs={"force_update": True})
+        # replace_existing: 同 id 的任务直接覆盖，保证只存在一个爬虫任务
+        scheduler.add_job(dynamic_task_wrapper, trigger, id='crawler_job', kwargs={"force_update": True}, replace_existing=True)
         return True
     except Exception as e:
         logger.error(f"❌ 更新定时任务失败: {e}")
         return False
 
+def _log_heavy_task_error(future: Future):
+    """重任务线程池的完成回调: 记录未捕获的异常 (否则会被 Future 静默吞掉)"""
+    exc = future.exception() if not future.cancelled() else None
+    if exc is not None:
+        logger.error(f"❌ 后台任务异常退出: {exc}", exc_info=exc)
+
+def submit_heavy_task(app: FastAPI, func, *args, **kwargs) -> bool:
+    """
+    将耗时任务提交到 lifespan 创建的专用线程池。
+    已有任务排队或运行中时拒绝提交并返回 False。
+    (只在事件循环线程中调用，检查与提交之间没有 await，无需额外加锁)
+    """
+    pending: Optional[Future] = getattr(app.state, "heavy_future", None)
+    if pending is not None and not pending.done():
+        return False
+    future = app.state.heavy_pool.submit(func, *args, **kwargs)
+    future.add_done_callback(_log_heavy_task_error)
+    app.state.heavy_future = future
+    return True
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global scheduler
     # 启动钩子
-    config = config_collection.find_one({"_id": "schedule_config"})
+    config = await async_config_collection.find_one({"_id": "schedule_config"})
     if not config:
         config = DEFAULT_SCHEDULE
-        config_collection.insert_one({"_id": "schedule_config", **DEFAULT_SCHEDULE})
+        await async_config_collection.insert_one({"_id": "schedule_config", **DEFAULT_SCHEDULE})
     
+    # 预编译首页模版并固定在 app.state 上，避免首个请求时才解析
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    templates.env.auto_reload = TEMPLATE_AUTO_RELOAD
+    app.state.index_tpl = templates.get_template("index.html")
+
+    # coalesce: 错过的多次触发合并为一次; max_instances=1: 同一时间只允许一个爬虫任务
+    scheduler = BackgroundScheduler(
+        timezone=LOCAL_TZ,
+        job_defaults={"coalesce": True, "max_instances": 1}
+    )
     update_scheduler_job(config)
     scheduler.start()
     logger.info("✅ 后台调度器已启动")
+
+    # 手动触发的重任务 (爬虫/重算) 使用独立的单线程池，不占用 FastAPI 的请求线程池，且天然串行
+    app.state.heavy_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="heavy-task")
     yield
     # 关闭钩子
     scheduler.shutdown()
     logger.info("🛑 后台调度器已关闭")
+    app.state.heavy_pool.shutdown(wait=False, cancel_futures=True)
+    if async_client is not None:
+        await async_client.close()
 
-app = FastAPI(lifespan=lifespan, title="港股全维财务监控系统", version="2.1.0")
+# 默认使用 orjson 序列化 (C 实现，NaN 输出为 null 而不是抛错)
+app = FastAPI(lifespan=lifespan, title="港股全维财务监控系统", version="2.1.0", default_response_class=ORJSONResponse)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+# 模版字节码缓存目录；生产环境关闭 auto_reload，开发时可设置 TEMPLATE_AUTO_RELOAD=1
+JINJA_CACHE_DIR = ".jinja_cache"
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "0") == "1"
 
 # === API 路由 ===
 
-@app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request):
+async def _render_index(request: Request, template) -> str:
+    """渲染首页 (只含页面框架与最后更新时间，表格数据由前端异步加载)"""
     last_time = status.last_finished_time
     if not last_time:
         try:
-            latest_doc = stock_collection.find_one(sort=[("updated_at", -1)])
+            # 只取 updated_at，避免解码整份文档 (含 history 等大字段)
+            latest_doc = await async_stock_collection.find_one({}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)])
             if latest_doc and "updated_at" in latest_doc:
                 last_time = latest_doc["updated_at"]
         except: pass
     last_time_str = last_time.strftime("%Y-%m-%d %H:%M") if last_time else "从未"
 
-    return templates.TemplateResponse("index.html", {
+    return template.render({
         "request": request, 
         "columns": COLUMN_CONFIG,
+        "columns_json": _COLUMNS_JSON,
         "last_updated": last_time_str
     })
 
+@app.get("/", response_class=HTMLResponse)
+async def read_root(request: Request):
+    if TEMPLATE_AUTO_RELOAD:
+        # 开发模式: 每次请求重新取模版 (auto_reload 会检查文件是否修改)，不走页面缓存和 ETag
+        return HTMLResponse(await _render_index(request, templates.get_template("index.html")))
+
+    # ETag 以任务完成时间为版本号，浏览器重复访问时直接返回 304
+    # 尚无任务完成时以进程启动时间兜底，避免重启后沿用旧页面
+    etag = f'"{status.last_finished_time.isoformat() if status.last_finished_time else _BOOT_TAG}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # url_for 生成的是绝对地址，缓存键需包含 base_url
+    cache_key = (status.last_finished_time, str(request.base_url))
+    if _index_page_cache["key"] == cache_key:
+        return HTMLResponse(_index_page_cache["html"], headers={"ETag": etag})
+
+    html = await _render_index(request, request.app.state.index_tpl)
+    _index_page_cache["key"] = cache_key
+    _index_page_cache["html"] = html
+    return HTMLResponse(html, headers={"ETag": etag})
+
+# 分页总数缓存: 翻页时筛选条件不变，复用同一次 count 结果
+# 键包含 last_finished_time，任务完成后自动失效；任务运行中依靠 TTL 刷新
+_COUNT_CACHE_TTL = 30.0
+_COUNT_CACHE_MAX = 512
+_count_cache: Dict[str, Tuple[float, int]] = {}
+
+def _count_cache_key(req: StockQueryRequest) -> str:
+    return json.dumps(
+        {"s": req.search, "f": req.filters, "v": status.last_finished_time},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+
+def _get_cached_count(key: str) -> Optional[int]:
+    """命中且未过期时返回缓存的总数，否则返回 None"""
+    hit = _count_cache.get(key)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+def _store_count(key: str, count: int):
+    if len(_count_cache) >= _COUNT_CACHE_MAX:
+        _count_cache.clear()
+    _count_cache[key] = (time.monotonic() + _COUNT_CACHE_TTL, count)
+
+# 文本类筛选字段 (关键词匹配，其余字段按数值范围筛选)
+_TEXT_FILTER_KEYS = frozenset(("所属行业", "bull_label"))
+# 直接对应文档顶层字段的前端列 (其余列位于 latest_data 下)
+_TOP_LEVEL_KEYS = frozenset(("_id", "name", "bull_label"))
+
+# 长牛评级年限区间 -> 标签列表 (1~5 年内的全部组合，启动时生成；区间为空时不存在对应键)
+_BULL_LABEL_SETS: Dict[Tuple[int, int], List[str]] = {
+    (start, end): [f"长牛{y}年" for y in range(start, end + 1)]
+    for start in range(1, 6) for end in range(start, 6)
+}
+
+@lru_cache(maxsize=256)
+def _map_db_key(key: str) -> str:
+    """前端列名 -> 数据库字段路径 (列名集合固定，结果缓存)"""
+    if key == "code": return "_id"
+    if key in _TOP_LEVEL_KEYS or key.startswith(("trend_analysis.", "ma_strategy.")): return key
+    return f"latest_data.{key}"
+
+def _parse_bound(val: Any, _float=float) -> Optional[float]:
+    """解析筛选范围的上下限，空值、NaN 或无法解析时返回 None"""
+    cls = val.__class__
+    # 快速路径: 前端 JSON 数字直接到达为 int/float，无需走字符串解析
+    if cls is _float: return val if val == val else None
+    if cls is int: return _float(val)
+    if val is None or val == "": return None
+    try: f = _float(val)
+    except (TypeError, ValueError): return None
+    return f if f == f else None
+
+# 港股代码固定为 5 位数字 (如 00700)
+_CODE_LEN = 5
+
+# 关键词是否包含英文字母 (只有此时才需要忽略大小写)
+_LATIN_RE = re.compile(r"[A-Za-z]")
+
+def _keyword_regex(keyword: str) -> Dict[str, str]:
+    """
+    构建关键词子串匹配条件。
+    转义用户输入，避免特殊字符被当作正则语法；不含英文字母时不加 i 选项，
+    区分大小写的正则可以直接在索引键上匹配。
+    """
+    pattern = re.escape(keyword.strip())
+    if _LATIN_RE.search(pattern):
+        return {"$regex": pattern, "$options": "i"}
+    return {"$regex": pattern}
+
+def _build_row(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """把一条股票文档展开为表格行 (列名与前端 g_columns 的 key 一致)"""
+    latest = doc.get('latest_data', {})
+    trend = doc.get("trend_analysis", {})
+    ma_strat = doc.get("ma_strategy", {}) 
+    
+    intro_fallback = latest.pop("企业简介", "")
+    item = {
+        "code": doc["_id"],
+        "name": doc["name"],
+        "date": "-",
+        "intro": doc.get("intro") or intro_fallback,
+        "is_ggt": doc.get("is_ggt", False),
+        "bull_label": doc.get("bull_label", ""),
+    }
+    # 数值格式化由前端完成，这里只透传表格列需要的原始值。
+    # latest 经过投影只含表格列和 date，先用空行模版补齐缺失列，再整体覆盖 (C 层 update，无逐列循环)
+    item.update(_EMPTY_LATEST_ROW)
+    item.update(latest)
+    for k, v in trend.items(): item[f"trend_analysis.{k}"] = v
+
+    if ma_strat:
+        item["ma_strategy.total_return"] = ma_strat.get("total_return")
+        item["ma_strategy.benchmark_return"] = ma_strat.get("benchmark_return")
+        params = ma_strat.get("params", {})
+        item["ma_strategy.buy_bias"] = params.get("buy_ma60_bias")
+        item["ma_strategy.sell_bias"] = params.get("sell_ma5_bias")
+        metrics = ma_strat.get("metrics", {})
+        item["ma_strategy.win_rate"] = metrics.get("win_rate")
+        item["ma_strategy.trades"] = metrics.get("trades")
+    return item
+
+# 翻页结果较大时改为流式输出: 边从游标取数据边发送，不必整页缓冲后再序列化
+STREAM_PAGE_SIZE = 200
+_STREAM_CHUNK_ROWS = 100
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+async def _stream_rows(header: Dict[str, Any], cursor):
+    """按块输出 {"total":..,"page":..,"page_size":..,"data":[...]}，与整页响应的结构相同"""
+    yield orjson.dumps(header)[:-1] + b',"data":['
+    sep = b""
+    buf: List[bytes] = []
+    async for doc in cursor:
+        buf.append(orjson.dumps(_build_row(doc), option=_ORJSON_OPTIONS))
+        if len(buf) >= _STREAM_CHUNK_ROWS:
+            yield sep + b",".join(buf)
+            sep, buf = b",", []
+    if buf: yield sep + b",".join(buf)
+    yield b"]}"
+
 @app.post("/api/stocks/query")
 async def query_stocks(req: StockQueryRequest):
     """
@@ -183,56 +421,58 @@ async def query_stocks(req: StockQueryRequest):
     
     # 1. 搜索
     if req.search:
-        query["$or"] = [
-            {"_id": {"$regex": req.search, "$options": "i"}},
-            {"name": {"$regex": req.search, "$options": "i"}}
-        ]
+        keyword = req.search.strip()
+        keyword_cond = _keyword_regex(keyword)
+        if len(keyword) == _CODE_LEN and keyword.isdigit():
+            # 完整代码: 子串匹配等价于精确匹配，直接按主键查找
+            query["_id"] = keyword
+        elif keyword.isdigit():
+            # 纯数字只可能是代码: 只在 _id 索引键上匹配，无需读取文档
+            query["_id"] = keyword_cond
+        else:
+            query["$or"] = [
+                {"_id": keyword_cond},
+                {"name": keyword_cond}
+            ]
     
     # 2. 筛选
     if req.filters:
         filter_conditions = []
         for key, range_val in req.filters.items():
-            db_key = key
-            if key == "code": db_key = "_id"
-            elif key.startswith("trend_analysis.") or key.startswith("ma_strategy.") or key == "bull_label": db_key = key 
-            elif key == "所属行业": db_key = "latest_data.所属行业"
-            elif key not in ["_id", "name"]: db_key = f"latest_data.{key}"
+            db_key = _map_db_key(key)
 
             min_v = range_val.get("min")
             max_v = range_val.get("max")
             
             # 长牛评级特殊处理 (例如 1-5年)
             if key == "bull_label":
-                try:
-                    target_labels = []
-                    start_year = int(float(min_v)) if (min_v is not None and min_v != "") else 1
-                    end_year = int(float(max_v)) if (max_v is not None and max_v != "") else 5
-                    for y in range(1, 6):
-                        if start_year <= y <= end_year:
-                            target_labels.append(f"长牛{y}年")
+                min_f = _parse_bound(min_v)
+                max_f = _parse_bound(max_v)
+                # 与原逻辑一致: 上下限无法解析时退回下方的文本匹配
+                if (min_f is not None or min_v in (None, "")) and (max_f is not None or max_v in (None, "")):
+                    start_year = max(int(min_f), 1) if min_f is not None else 1
+                    end_year = min(int(max_f), 5) if max_f is not None else 5
+                    target_labels = _BULL_LABEL_SETS.get((start_year, end_year))
                     if target_labels:
                         filter_conditions.append({db_key: {"$in": target_labels}})
                     continue
-                except ValueError: pass
 
             # 文本模糊匹配
-            if key in ["所属行业", "bull_label"]:
-                if min_v: filter_conditions.append({db_key: {"$regex": str(min_v), "$options": "i"}})
+            if key in _TEXT_FILTER_KEYS:
+                if min_v: filter_conditions.append({db_key: _keyword_regex(str(min_v))})
                 continue 
 
             # 数值范围匹配
             range_query = {}
-            if min_v is not None and min_v != "":
-                try: range_query["$gte"] = float(min_v)
-                except: pass
-            if max_v is not None and max_v != "":
-                try: range_query["$lte"] = float(max_v)
-                except: pass
+            min_f = _parse_bound(min_v)
+            if min_f is not None: range_query["$gte"] = min_f
+            max_f = _parse_bound(max_v)
+            if max_f is not None: range_query["$lte"] = max_f
             if range_query:
                 filter_conditions.append({db_key: range_query})
         
         if filter_conditions:
-            if "$or" in query: query = {"$and": [query, *filter_conditions]}
+            if query: query = {"$and": [query, *filter_conditions]}
             else: 
                 if len(filter_conditions) == 1: query.update(filter_conditions[0])
                 else: query["$and"] = filter_conditions
@@ -240,62 +480,86 @@ async def query_stocks(req: StockQueryRequest):
     # 3. 排序
     sort_stage = [("_id", 1)]
     if req.sort_key:
-        db_sort_key = req.sort_key
-        if req.sort_key == "code": db_sort_key = "_id"
-        elif req.sort_key not in ["_id", "name", "bull_label"] and not req.sort_key.startswith("trend_analysis") and not req.sort_key.startswith("ma_strategy"):
-             db_sort_key = f"latest_data.{req.sort_key}"
-             
+        db_sort_key = _map_db_key(req.sort_key)
         direction = 1 if req.sort_dir == "asc" else -1
         sort_stage = [(db_sort_key, direction)]
 
     # 4. 执行查询
-    total_count = stock_collection.count_documents(query)
-    cursor = stock_collection.find(query).sort(sort_stage).skip((req.page - 1) * req.page_size).limit(req.page_size)
+    skip = (req.page - 1) * req.page_size
+    count_key = _count_cache_key(req)
+    total_count = _get_cached_count(count_key)
+    if total_count is None and not query:
+        # 无搜索/筛选: 总数直接取集合元数据，无需扫描计数
+        total_count = await async_stock_collection.estimated_document_count()
+        _store_count(count_key, total_count)
+    # 当前页始终用 find().sort().skip().limit()，排序可以走索引
+    # ($facet 内的 $sort 无法使用索引，会对全部匹配文档做内存排序)
+    cursor = async_stock_collection.find(query, _QUERY_PROJECTION).sort(sort_stage).skip(skip).limit(req.page_size)
+    if total_count is None:
+        # 总数未缓存 (通常是第一页): 计数与取页并发执行，耗时约为一次往返
+        # 首批默认只返回 101 条，按页大小设置批量，整页一次往返取回
+        total_count, docs = await asyncio.gather(
+            async_stock_collection.count_documents(query),
+            cursor.batch_size(req.page_size).to_list()
+        )
+        _store_count(count_key, total_count)
+    elif req.page_size >= STREAM_PAGE_SIZE:
+        # 翻页且页较大: 总数已缓存，边读游标边输出
+        header = {"total": total_count, "page": req.page, "page_size": req.page_size}
+        return StreamingResponse(
+            _stream_rows(header, cursor.batch_size(_STREAM_CHUNK_ROWS)), media_type="application/json"
+        )
+    else:
+        # 翻页: 总数已缓存，只查当前页
+        docs = await cursor.batch_size(req.page_size).to_list()
     
-    data = []
-    for doc in cursor:
-        latest = doc.get('latest_data', {})
-        trend = doc.get("trend_analysis", {})
-        ma_strat = doc.get("ma_strategy", {}) 
-        
-        item = {
-            "code": doc["_id"],
-            "name": doc["name"],
-            "date": latest.get("date", "-"),
-            "intro": doc.get("intro") or latest.get("企业简介", ""),
-            "is_ggt": doc.get("is_ggt", False),
-            "bull_label": doc.get("bull_label", ""),
-            **latest 
-        }
-        for k, v in trend.items(): item[f"trend_analysis.{k}"] = v
-
-        if ma_strat:
-            item["ma_strategy.total_return"] = ma_strat.get("total_return")
-            item["ma_strategy.benchmark_return"] = ma_strat.get("benchmark_return")
-            params = ma_strat.get("params", {})
-            item["ma_strategy.buy_bias"] = params.get("buy_ma60_bias")
-            item["ma_strategy.sell_bias"] = params.get("sell_ma5_bias")
-            metrics = ma_strat.get("metrics", {})
-            item["ma_strategy.win_rate"] = metrics.get("win_rate")
-            item["ma_strategy.trades"] = metrics.get("trades")
-            
-        data.append(item)
-
-    return {
+    # 直接交给 orjson 序列化，跳过 jsonable_encoder 对每行每列的遍历
+    return ORJSONResponse({
         "total": total_count,
         "page": req.page,
         "page_size": req.page_size,
-        "data": data
-    }
+        "data": [_build_row(doc) for doc in docs]
+    })
 
 @app.get("/api/history/{code}")
-async def get_history(code: str):
-    doc = stock_collection.find_one({"_id": code}, {"name": 1, "history": 1})
+async def get_history(
+    code: str,
+    field: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    since: Optional[str] = None
+):
+    """
+    个股历史数据 (图表使用)。
+    field: 只返回 date 和该字段；limit: 只返回最近 N 条；since: 只返回该日期 (YYYY-MM-DD) 之后的记录。
+    未传参数时返回完整 history。
+    """
+    # 字段名不允许包含路径/操作符字符，否则退回返回全部字段
+    if field and (field.startswith("$") or "." in field): field = None
+
+    if field or limit or since:
+        # 在服务端完成筛选/截取/投影，只传输图表需要的数据
+        history_expr: Any = "$history"
+        if since:
+            history_expr = {"$filter": {"input": history_expr, "cond": {"$gte": ["$$this.date", since]}}}
+        if limit:
+            history_expr = {"$slice": [history_expr, -limit]}
+        if field:
+            history_expr = {"$map": {"input": history_expr, "in": {"date": "$$this.date", field: f"$$this.{field}"}}}
+        pipeline = [
+            {"$match": {"_id": code}},
+            {"$project": {"name": 1, "history": {"$ifNull": [history_expr, []]}}}
+        ]
+        agg_cursor = await async_stock_collection.aggregate(pipeline)
+        docs = await agg_cursor.to_list()
+        doc = docs[0] if docs else None
+    else:
+        doc = await async_stock_collection.find_one({"_id": code}, {"name": 1, "history": 1})
     if not doc: return {"name": code, "history": []}
-    return {"name": doc["name"], "history": doc.get("history", [])}
+    # 历史数据量大，直接交给 orjson 序列化，跳过 jsonable_encoder 的逐层遍历
+    return ORJSONResponse({"name": doc["name"], "history": doc.get("history", [])})
 
 @app.get("/api/trigger_crawl")
-async def trigger_crawl(background_tasks: BackgroundTasks, force: bool = False):
+async def trigger_crawl(request: Request, force: bool = False):
     """
     手动触发爬虫接口
     
@@ -306,7 +570,8 @@ async def trigger_crawl(background_tasks: BackgroundTasks, force: bool = False):
         return {"success": False, "message": "任务正在运行中，请勿重复触发"}
     
     # 传递 force_update 参数
-    background_tasks.add_task(dynamic_task_wrapper, force_update=force)
+    if not submit_heavy_task(request.app, dynamic_task_wrapper, force_update=force):
+        return {"success": False, "message": "任务正在运行中，请勿重复触发"}
     
     mode_text = "强制重爬" if force else "智能刷新"
     return {"success": True, "message": f"后台任务已启动 ({mode_text} + 趋势分析 + 策略优化 + 钉钉通知)"}
@@ -319,23 +584,52 @@ async def stop_crawl():
     return {"success": True, "message": "正在终止任务，请稍候..."}
 
 @app.post("/api/recalculate")
-async def trigger_recalculate(background_tasks: BackgroundTasks):
+async def trigger_recalculate(request: Request):
     if status.is_running:
         return {"success": False, "message": "后台已有任务在运行"}
-    background_tasks.add_task(maintenance_service.run_recalculate_task)
+    if not submit_heavy_task(request.app, maintenance_service.run_recalculate_task):
+        return {"success": False, "message": "后台已有任务在运行"}
     return {"success": True, "message": "已开始补全计算"}
 
 @app.get("/api/status")
 async def get_status():
-    return {
-        "is_running": status.is_running,
-        "current": status.current,
-        "total": status.total,
-        "message": status.message
-    }
+    # 前端轮询频繁，直接返回预序列化的快照
+    return Response(status.snapshot_json(), media_type="application/json")
+
+# 状态推送 (SSE): 每 0.5 秒检查一次，仅在快照变化时推送
+STATUS_STREAM_INTERVAL = 0.5
+# 单个连接的最长保持时间: 到期后服务端主动结束，浏览器按 retry 自动重连
+# (避免长连接阻塞 uvicorn 的优雅退出/重启)
+STATUS_STREAM_MAX_SECONDS = 15
+# 收到重启请求后置位: 推送循环立即结束，避免 uvicorn 优雅退出时等待长连接
+_restart_requested = False
+
+@app.get("/api/status/stream")
+async def stream_status(request: Request):
+    async def event_generator():
+        last = None
+        deadline = time.monotonic() + STATUS_STREAM_MAX_SECONDS
+        yield b"retry: 1000\n\n"
+        while time.monotonic() < deadline and not _restart_requested:
+            if await request.is_disconnected(): break
+            snapshot = status.snapshot_json()
+            if snapshot != last:
+                last = snapshot
+                yield b"data: " + snapshot + b"\n\n"
+            await asyncio.sleep(STATUS_STREAM_INTERVAL)
+
+    return StreamingResponse(
+        event_generator(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 def restart_program():
-    time.sleep(0.5) 
+    global _restart_requested
+    # 先结束所有状态推送连接，重载时无需等待它们超时
+    _restart_requested = True
+    # BackgroundTasks 在响应发送完成后才执行，无需再 sleep 等待
+    # 注意: 使用 uvicorn reload 模式启动时，重载器只在文件变化时重启 worker，
+    # 直接向 worker 发 SIGTERM 只会让服务退出，因此仍通过 touch 触发重载
     current_file = os.path.abspath(__file__)
     if os.path.exists(current_file):
         os.utime(current_file, None) # 触发 uvicorn reload
@@ -345,43 +639,79 @@ async def restart_service(background_tasks: BackgroundTasks):
     background_tasks.add_task(restart_program)
     return {"success": True, "message": "服务正在重载，页面将在 3 秒后刷新..."}
 
+def _versioned_json_response(request: Request, version: int, content: Any) -> Response:
+    """
+    带 ETag 的 JSON 响应: 版本未变时返回 304。
+    no-cache 表示浏览器每次都要带 If-None-Match 重新验证，保存后立即可见新数据。
+    """
+    etag = f'W/"{_BOOT_TAG}-{version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return ORJSONResponse(content, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
 @app.get("/api/schedule")
-async def get_schedule():
-    config = config_collection.find_one({"_id": "schedule_config"})
-    if not config: config = DEFAULT_SCHEDULE
-    return config
+async def get_schedule(request: Request):
+    global _schedule_cache
+    if _schedule_cache is not None:
+        return _versioned_json_response(request, _schedule_version, _schedule_cache)
+    # 与 get_templates 相同: 读库期间配置被修改时不写入缓存
+    version = _schedule_version
+    config = await async_config_collection.find_one({"_id": "schedule_config"}) or DEFAULT_SCHEDULE
+    if version == _schedule_version:
+        _schedule_cache = config
+    return _versioned_json_response(request, version, config)
 
 @app.post("/api/schedule")
 async def set_schedule(req: ScheduleRequest):
+    global _schedule_cache, _schedule_version
     new_config = req.dict()
-    config_collection.update_one({"_id": "schedule_config"}, {"$set": new_config}, upsert=True)
+    await async_config_collection.update_one({"_id": "schedule_config"}, {"$set": new_config}, upsert=True)
+    _schedule_cache = None
+    _schedule_version += 1
     
     if update_scheduler_job(new_config):
         return {"success": True, "message": "定时任务已更新"}
     else:
         return {"success": False, "message": "调度器更新失败"}
 
+def _invalidate_templates_cache():
+    global _templates_cache, _templates_version
+    _templates_cache = None
+    _templates_version += 1
+
 @app.get("/api/templates")
-async def get_templates():
-    cursor = template_collection.find({}, {"_id": 0}).sort("name", 1)
-    return list(cursor)
+async def get_templates(request: Request):
+    global _templates_cache
+    if _templates_cache is not None:
+        return _versioned_json_response(request, _templates_version, _templates_cache)
+    # 读库期间可能有保存/删除完成并使缓存失效: 只有版本号未变时才写入缓存，
+    # 否则本次结果可能是写入前的旧数据，仅返回 (使用读库前的版本号，客户端下次会重新获取)
+    version = _templates_version
+    cursor = async_template_collection.find({}, {"_id": 0, "name": 1, "filters": 1}).sort("name", 1)
+    result = await cursor.to_list()
+    if version == _templates_version:
+        _templates_cache = result
+    return _versioned_json_response(request, version, result)
 
 @app.post("/api/templates")
 async def save_template(req: TemplateRequest):
     if not req.name.strip(): return {"success": False, "message": "模版名称不能为空"}
     if not req.filters: return {"success": False, "message": "模版内容不能为空"}
     
-    template_collection.replace_one(
+    await async_template_collection.replace_one(
         {"name": req.name.strip()}, 
         {"name": req.name.strip(), "filters": req.filters}, 
         upsert=True
     )
+    _invalidate_templates_cache()
     return {"success": True, "message": "模版已保存"}
 
 @app.delete("/api/templates/{name}")
 async def delete_template(name: str):
-    result = template_collection.delete_one({"name": name})
+    result = await async_template_collection.delete_one({"name": name})
+    _invalidate_templates_cache()
     return {"success": result.deleted_count > 0, "message": "模版已删除" if result.deleted_count > 0 else "模版不存在"}
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # 优雅退出最多等待 3 秒 (手动修改文件触发重载时，仍在推送的 SSE 连接不会拖住重启)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, timeout_graceful_shutdown=3)
\ No newline at end of file
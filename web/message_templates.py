@@ -44,26 +44,22 @@ class DingTalkTemplates:
         if buy_signals:
             content.append("\n### 🟢 触发买入")
             # [修改] 使用无序列表 (-) 强制换行，让每条信息更清晰
-            for s in buy_signals:
-                content.append(f"- {s}")
+            content.extend(f"- {s}" for s in buy_signals)
 
         # 3. 🔴 强力卖出区域
         if sell_signals:
             content.append("\n### 🔴 触发卖出")
-            for s in sell_signals:
-                content.append(f"- {s}")
+            content.extend(f"- {s}" for s in sell_signals)
             
         # 4. 📉 接近买点 (观察区)
         if approach_buy:
             content.append("\n#### 📉 接近买点 (观察)")
-            for s in approach_buy:
-                content.append(f"- {s}")
+            content.extend(f"- {s}" for s in approach_buy)
 
         # 5. 📈 接近卖点 (观察区)
         if approach_sell:
             content.append("\n#### 📈 接近卖点 (观察)")
-            for s in approach_sell:
-                content.append(f"- {s}")
+            content.extend(f"- {s}" for s in approach_sell)
             
         # 6. 底部签名
         content.append("\n---")
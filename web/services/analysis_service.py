@@ -1,12 +1,11 @@
 # 文件路径: web/services/analysis_service.py
 import numpy as np
 import pandas as pd
-from scipy import stats
 from datetime import datetime, timedelta
 import akshare as ak
 import os
 import time
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from numba import jit
 from typing import Optional, Dict, List, Tuple
 from config import StrategyConfig, DingTalkConfig
@@ -20,6 +19,16 @@ RSI_BUY_THRESHOLD = 40.0       # 买入过滤：RSI必须处于弱势区 (防止
 RSI_SELL_THRESHOLD = 75.0      # 卖出增强：RSI进入超买区可降低卖出阈值
 RSI_SELL_BIAS_FACTOR = 0.8     # 如果 RSI 超买，卖出乖离率阈值打折系数 (例如原定10%卖，超买时8%就卖)
 
+# === 趋势分析并发配置 ===
+# 单只股票的分析以读库/补拉行情的 I/O 等待为主，用少量线程重叠网络往返
+TREND_MAX_WORKERS = 4
+TREND_BATCH_SIZE = 20          # 每批分析完成后让出 0.1 秒，避免长时间占用 API 进程
+# 待分析股票: 从未分析过，或上次分析 (trend_checked_at) 早于最近一次数据更新 (updated_at)
+TREND_STALE_QUERY = {"$or": [
+    {"trend_checked_at": {"$exists": False}},
+    {"$expr": {"$lt": ["$trend_checked_at", "$updated_at"]}}
+]}
+
 # === Numba 加速内核 (已增加 RSI 逻辑) ===
 @jit(nopython=True)
 def backtest_numba(
@@ -190,6 +199,22 @@ def _worker_optimize_stock(doc_data: Dict) -> Optional[Tuple[str, str, Dict]]:
 
     except Exception: return None
 
+def _log_linear_fit(x: np.ndarray, log_y: np.ndarray) -> Tuple[float, float]:
+    """
+    对 (x, log_y) 做最小二乘直线拟合，返回 (斜率, R²)。
+    只计算趋势判定用到的两项，省去 linregress 的 p 值和标准误；
+    x 或 y 无波动时 R² 按 0 处理 (与 linregress 的 r=0 一致)。
+    """
+    dx = x - x.mean()
+    dy = log_y - log_y.mean()
+    sxx = np.dot(dx, dx)
+    syy = np.dot(dy, dy)
+    if sxx <= 0: return 0.0, 0.0
+    sxy = np.dot(dx, dy)
+    slope = sxy / sxx
+    r2 = min(sxy * sxy / (sxx * syy), 1.0) if syy > 0 else 0.0
+    return slope, r2
+
 class AnalysisService:
     def __init__(self, db_collection, status_tracker=None):
         self.collection = db_collection
@@ -199,36 +224,45 @@ class AnalysisService:
         """执行长牛趋势分析"""
         logger.info("🚀 Service: 开始执行【5年长牛分级筛选】(优化内存模式)...")
         
-        cursor = self.collection.find({}, {"_id": 1, "name": 1, "latest_data": 1})
-        all_basic_docs = list(cursor)
-        
-        total = len(all_basic_docs)
+        # 只分析上次分析之后行情有更新 (爬虫会刷新 updated_at) 或从未分析过的股票
+        total = self.collection.count_documents(TREND_STALE_QUERY)
         if self.status:
             self.status.start(total)
             self.status.message = "正在进行趋势分析..."
 
         logger.info(f"📊 待分析股票数量: {total}")
 
-        for i, basic_doc in enumerate(all_basic_docs):
-            if self.status and self.status.should_stop: break
-            
-            code = basic_doc["_id"]
-            if str(code).startswith("8"): continue
+        # 游标按批次流式读取，避免一次性载入全部文档
+        cursor = self.collection.find(
+            TREND_STALE_QUERY, {"_id": 1, "name": 1}, no_cursor_timeout=True
+        ).batch_size(200)
+        processed = 0
+        batch: List[Dict] = []
+        try:
+            with ThreadPoolExecutor(max_workers=TREND_MAX_WORKERS, thread_name_prefix="trend") as pool:
+                for i, basic_doc in enumerate(cursor):
+                    if self.status and self.status.should_stop: break
+                    processed = i + 1
+                    
+                    code = basic_doc["_id"]
+                    if str(code).startswith("8"): continue
 
-            if self.status: self.status.update(i + 1, message=f"分析: {basic_doc.get('name')}")
-            
-            if i % 20 == 0:
-                time.sleep(0.1)
+                    if self.status and self.status.should_report(i + 1):
+                        self.status.update(i + 1, message=f"分析: {basic_doc.get('name')}")
 
-            try:
-                full_doc = self.collection.find_one({"_id": code}, {"qfq_history": 1, "latest_data": 1})
-                if full_doc:
-                    full_doc["name"] = basic_doc.get("name")
-                    self._analyze_single_stock(full_doc)
-                    
-            except Exception as e:
-                logger.warning(f"⚠️ 分析 {code} 失败: {e}")
+                    # 按小批并发分析，游标仍逐批读取，内存中最多只有一批完整文档
+                    batch.append(basic_doc)
+                    if len(batch) >= TREND_BATCH_SIZE:
+                        list(pool.map(self._analyze_by_code, batch))
+                        batch = []
+                        time.sleep(0.1)
+
+                if batch and not (self.status and self.status.should_stop):
+                    list(pool.map(self._analyze_by_code, batch))
+        finally:
+            cursor.close()
 
+        if self.status: self.status.update(processed)
         logger.info("✅ Service: 趋势分析阶段完成")
 
     def optimize_strategies(self):
@@ -409,6 +443,17 @@ class AnalysisService:
         else:
             logger.info("🔕 今日无重点信号触发")
 
+    def _analyze_by_code(self, basic_doc: Dict):
+        """读取单只股票的行情数据并分析 (在线程池中执行，异常只记录不抛出)"""
+        code = basic_doc["_id"]
+        try:
+            full_doc = self.collection.find_one({"_id": code}, {"qfq_history": 1, "latest_data": 1})
+            if full_doc:
+                full_doc["name"] = basic_doc.get("name")
+                self._analyze_single_stock(full_doc)
+        except Exception as e:
+            logger.warning(f"⚠️ 分析 {code} 失败: {e}")
+
     def _analyze_single_stock(self, doc: Dict):
         code = doc["_id"]
         latest = doc.get("latest_data", {})
@@ -416,7 +461,7 @@ class AnalysisService:
         roe = latest.get("股东权益回报率(%)")
 
         if (mcap is None or mcap < StrategyConfig.MIN_MARKET_CAP) or (roe is None or roe <= 0):
-            self.collection.update_one({"_id": code}, {"$unset": {"bull_label": "", "trend_analysis": ""}})
+            self._save_trend_result(code)
             return
 
         qfq_data = doc.get("qfq_history", [])
@@ -445,36 +490,41 @@ class AnalysisService:
             prev_20 = df.iloc[-20]
             if pd.notna(curr['trend_short']) and pd.notna(curr['trend_long']):
                 if curr['trend_short'] < curr['trend_long'] and curr['trend_long'] < prev_20['trend_long']:
-                    self.collection.update_one({"_id": code}, {"$unset": {"bull_label": "", "trend_analysis": ""}})
+                    self._save_trend_result(code)
                     return
 
         latest_date = df['date'].iloc[-1]
         bull_label = None
         trend_data = {}
 
+        # 各年限窗口共用的数组只计算一次，窗口内只做切片 (视图，无复制)
+        # 日期按升序排列 (行情接口返回顺序)，窗口起点用二分查找代替逐行布尔掩码
+        dates = df['date']
+        close_arr = df['close'].to_numpy(dtype=float)
+        amount_arr = df['amount_est'].to_numpy(dtype=float)
+        # 回归的斜率与 R² 不受 x 平移影响，统一以最新日期为原点 (单位: 年)
+        x_all = (dates - latest_date).dt.days.to_numpy() / 365.25
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_all = np.log(close_arr)
+
         for year in [5, 4, 3, 2, 1]:
             try: target_start = latest_date - pd.DateOffset(years=year)
             except: target_start = latest_date - timedelta(days=365 * year)
             
-            mask = df['date'] >= target_start
-            if not mask.any(): continue
-            df_sub = df[mask].copy()
+            start = int(dates.searchsorted(target_start, side='left'))
+            if start >= len(df): continue
+            df_sub = df.iloc[start:]
             
-            if df_sub.empty: continue
             if (df_sub['date'].iloc[0] - target_start).days > 30: continue
-            if df_sub['amount_est'].mean() < StrategyConfig.MIN_TURNOVER: continue
+            avg_turnover = amount_arr[start:].mean()
+            if avg_turnover < StrategyConfig.MIN_TURNOVER: continue
             
             if self._check_ma_interruption(df_sub): continue
             
-            y_data = df_sub['close'].values
+            y_data = close_arr[start:]
             if len(y_data) < StrategyConfig.MIN_REGRESSION_SAMPLES or np.any(y_data <= 0): continue
             
-            start_ts = df_sub['date'].iloc[0]
-            x_data = (df_sub['date'] - start_ts).dt.days.values / 365.25
-            log_y = np.log(y_data)
-            
-            slope, intercept, r_value, _, _ = stats.linregress(x_data, log_y)
-            r2 = r_value ** 2
+            slope, r2 = _log_linear_fit(x_all[start:], log_all[start:])
             ann_ret = (np.exp(slope) - 1) * 100
             
             if r2 >= StrategyConfig.MIN_R_SQUARED and slope > 0 and \
@@ -485,15 +535,21 @@ class AnalysisService:
                     "annual_return_pct": round(ann_ret, 2),
                     "slope": round(slope, 6),
                     "period_years": year,
-                    "avg_turnover": round(df_sub['amount_est'].mean(), 0),
+                    "avg_turnover": round(avg_turnover, 0),
                     "updated_at": datetime.now()
                 }
                 break
 
+        self._save_trend_result(code, bull_label, trend_data)
+
+    def _save_trend_result(self, code: str, bull_label: Optional[str] = None, trend_data: Optional[Dict] = None):
+        """写回趋势分析结果并记录分析时间 (trend_checked_at)，无评级时清除旧评级"""
+        update: Dict = {"$set": {"trend_checked_at": datetime.now()}}
         if bull_label:
-            self.collection.update_one({"_id": code}, {"$set": {"bull_label": bull_label, "trend_analysis": trend_data}})
+            update["$set"].update({"bull_label": bull_label, "trend_analysis": trend_data})
         else:
-            self.collection.update_one({"_id": code}, {"$unset": {"bull_label": "", "trend_analysis": ""}})
+            update["$unset"] = {"bull_label": "", "trend_analysis": ""}
+        self.collection.update_one({"_id": code}, update)
 
     def _check_ma_interruption(self, df_subset):
         col_name = 'trend_long'
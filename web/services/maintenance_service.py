@@ -1,126 +1,292 @@
 # 文件路径: web/services/maintenance_service.py
 import math
-from typing import List, Dict, Any, Optional
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from numba import jit
+from typing import List, Dict, Any, Optional, Tuple
 from pymongo import UpdateOne
 from pymongo.collection import Collection
-from config import NUMERIC_FIELDS, ValuationConfig # 引入配置
+from pymongo.errors import BulkWriteError
+from config import NUMERIC_FIELDS, NUMERIC_STRIP_TRANS, ValuationConfig # 引入配置
 from logger import sys_logger as logger
 
+# 重算进程池大小
+RECALC_MAX_WORKERS = min(os.cpu_count() or 1, 4)
+
+# 衍生指标公式版本: 修改任何衍生指标公式或类型修复逻辑时递增，
+# 重算任务只处理 derived_version 低于此值 (或缺失) 的文档
+DERIVED_VERSION = 1
+
+# 衍生指标依赖的基础字段 (每项为候选键名，按顺序取第一个有效值)
+# 顺序与 _compute_derived_metrics 的参数顺序一致
+_METRIC_KEYS: Tuple[Tuple[str, ...], ...] = (
+    ('市盈率', 'PE'),
+    ('基本每股收益(元)', '基本每股收益'),
+    ('每股净资产(元)', '每股净资产'),
+    ('净利润滚动环比增长(%)', '净利润环比增长'),
+    ('股息率TTM(%)', '股息率'),
+    ('每股经营现金流(元)', '每股经营现金流'),
+    ('股东权益回报率(%)', 'ROE'),
+    ('总资产回报率(%)', 'ROA'),
+    ('销售净利率(%)', '销售净利率'),
+)
+
+
+def _to_float(val: Any, _float=float, _str=str) -> float:
+    """将原始值解析为 float，无法解析返回 NaN"""
+    cls = val.__class__
+    # 快速路径: BSON 数值类型直接返回 (排除 bool)
+    if cls is float: return val
+    if cls is int: return _float(val)
+    try: return _float(_str(val).translate(NUMERIC_STRIP_TRANS))
+    except: return math.nan
+
+def _get_f(item: Dict, keys: Tuple[str, ...], _to_float=_to_float, _isnan=math.isnan) -> float:
+    """按候选键名顺序取第一个可解析的数值 (缺失返回 NaN)"""
+    for k in keys:
+        val = item.get(k)
+        if val is not None:
+            f = _to_float(val)
+            if not _isnan(f): return f
+    return math.nan
+
+def _extract_metric_columns(history: List[Dict]) -> np.ndarray:
+    """按列抽取全部基础字段，返回形状为 (9, n) 的数组 (按行连续，可直接传给 Numba 内核)"""
+    get_f = _get_f
+    _float = float
+    out = np.empty((len(_METRIC_KEYS), len(history)), dtype=np.float64)
+    for j, keys in enumerate(_METRIC_KEYS):
+        primary = keys[0]
+        col: List[float] = []
+        append = col.append
+        for item in history:
+            val = item.get(primary)
+            # 快速路径: 主键名已是有效 float (类型修复后的常见情况)，无需逐个候选键解析
+            if val.__class__ is _float and val == val: append(val)
+            else: append(get_f(item, keys))
+        out[j] = col
+    return out
+
+# 衍生指标输出列顺序 (与 _derived_metrics_numba 的输出列一一对应)
+DERIVED_FIELDS: Tuple[str, ...] = (
+    'PEG', 'PEGY', '合理股价', '净现比', '市现率', '财务杠杆', '总资产周转率', '格雷厄姆数'
+)
+# 各衍生指标保留的小数位 (与 DERIVED_FIELDS 一一对应)
+DERIVED_DIGITS: Tuple[int, ...] = (4, 4, 2, 2, 2, 2, 2, 2)
+
+# === Numba 加速内核 ===
+# 注意: 不开启 fastmath，内核依赖 NaN 表示"缺失/不满足条件" (NaN 输入经运算自然传播为 NaN)
+# 内核只输出未取整的值: Numba 的 round(x, n) 按"乘 10^n 取整再除"实现，
+# 与 Python round (按精确十进制值舍入) 在个别值上相差末位一个单位，取整统一在写回时用 Python round 完成
+@jit(nopython=True, cache=True)
+def _derived_metrics_numba(
+    pe: np.ndarray, eps: np.ndarray, bvps: np.ndarray, growth: np.ndarray,
+    div_yield: np.ndarray, ocf_ps: np.ndarray, roe: np.ndarray, roa: np.ndarray,
+    net_margin: np.ndarray,
+    fair_base: float, fair_growth_multiplier: float, graham_const: float
+) -> np.ndarray:
+    n = len(pe)
+    out = np.full((n, 8), np.nan)
+
+    for i in range(n):
+        p = pe[i]
+        e = eps[i]
+        g = growth[i]
+        ocf = ocf_ps[i]
+        ra = roa[i]
+
+        if p > 0 and g != 0:
+            out[i, 0] = p / g
+
+        tr = g + div_yield[i]
+        if p > 0 and tr > 0:
+            out[i, 1] = p / tr
+
+        # 公式: EPS * (8.5 + 2 * g)
+        fair_price = e * (fair_base + fair_growth_multiplier * g)
+        if fair_price > 0:
+            out[i, 2] = fair_price
+
+        if e > 0:
+            out[i, 3] = ocf / e
+
+        if p > 0 and e > 0 and ocf != 0:
+            out[i, 4] = p * e / ocf
+
+        if ra != 0:
+            out[i, 5] = roe[i] / ra
+
+        nm = net_margin[i]
+        if nm != 0:
+            out[i, 6] = ra / nm
+
+        # 公式: Sqrt(22.5 * EPS * BVPS)
+        graham_base = graham_const * e * bvps[i]
+        if graham_base > 0:
+            out[i, 7] = np.sqrt(graham_base)
+
+    return out
+
+def _compute_derived_metrics(
+    pe: np.ndarray, eps: np.ndarray, bvps: np.ndarray, growth: np.ndarray,
+    div_yield: np.ndarray, ocf_ps: np.ndarray, roe: np.ndarray, roa: np.ndarray,
+    net_margin: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    对整段历史一次性计算衍生估值指标 (未取整，见 DERIVED_DIGITS)。
+    条件与逐条计算时一致，不满足条件的位置为 NaN。
+    """
+    out = _derived_metrics_numba(
+        pe, eps, bvps, growth, div_yield, ocf_ps, roe, roa, net_margin,
+        ValuationConfig.FAIR_PRICE_BASE,
+        ValuationConfig.FAIR_PRICE_GROWTH_MULTIPLIER,
+        ValuationConfig.GRAHAM_CONST
+    )
+    return {field: out[:, j] for j, field in enumerate(DERIVED_FIELDS)}
+
+def _warmup_derived_kernel():
+    """
+    在主进程中预先编译 Numba 内核 (空数组即可触发编译)。
+    进程池 fork 出的子进程直接继承已编译的函数，不会各自重复编译。
+    """
+    _compute_derived_metrics(*np.empty((len(_METRIC_KEYS), 0), dtype=np.float64))
+
+# === 重算子进程函数 ===
+def _worker_recalculate_stock(doc: Dict) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    修复单只股票历史数据的类型并重算衍生指标 (纯计算，不访问数据库)。
+    返回 (code, $set 内容)：只包含实际变化的 history.<i>.<field> 路径；
+    变化项多于记录条数时退化为整体写回 history。无任何变化时 $set 内容为空。
+    """
+    history = doc.get("history", [])
+    if not history: return doc["_id"], {}
+
+    changed: List[Tuple[int, str]] = []
+
+    # history 中的记录原地修改，直接作为写回内容，无需再复制一份列表
+    for i, item in enumerate(history):
+        # 修复数据类型
+        for k, v in item.items():
+            if k in NUMERIC_FIELDS and isinstance(v, str):
+                try:
+                    item[k] = float(v.translate(NUMERIC_STRIP_TRANS))
+                    changed.append((i, k))
+                except: pass 
+
+    # 整列向量化计算衍生指标，仅回写有效值 (NaN 表示不满足计算条件)
+    # 取整使用 Python round，保证与爬虫入库时的结果逐位一致
+    derived = _compute_derived_metrics(*_extract_metric_columns(history))
+    for ndigits, (field, values) in zip(DERIVED_DIGITS, derived.items()):
+        for i, val in enumerate(values.tolist()):
+            if val != val: continue
+            val = round(val, ndigits)
+            if history[i].get(field) != val:
+                history[i][field] = val
+                changed.append((i, field))
+
+    latest_record = history[-1]
+    latest_in_sync = doc.get("latest_data") == latest_record
+    if not changed and latest_in_sync: return doc["_id"], {}
+
+    if len(changed) > len(history):
+        update_fields: Dict[str, Any] = {"history": history}
+    else:
+        update_fields = {f"history.{i}.{k}": history[i][k] for i, k in changed}
+    if not latest_in_sync:
+        update_fields["latest_data"] = latest_record
+
+    return doc["_id"], update_fields
+
 class MaintenanceService:
     def __init__(self, collection: Collection, status_tracker: Any):
         self.collection = collection
         self.status = status_tracker
 
     def run_recalculate_task(self):
+        """
+        全库清洗重算。
+        本方法只负责读库、分发和写库，计算交给进程池，避免占用 API 进程的 GIL。
+        """
         logger.info("🔄 Service: 开始执行离线补全指标与类型修复...")
         
-        total = self.collection.count_documents({})
+        # 只处理衍生指标版本落后的文档 (新爬取的数据会清除版本号)
+        query = {"$or": [
+            {"derived_version": {"$lt": DERIVED_VERSION}},
+            {"derived_version": {"$exists": False}}
+        ]}
+        total = self.collection.count_documents(query)
         self.status.start(total)
         self.status.message = "正在扫描数据库..."
 
-        cursor = self.collection.find({})
-        batch_ops: List[UpdateOne] = []
-        BATCH_SIZE = 50 
+        # 只取重算需要的字段，避免把 qfq_history (日线行情) 等大字段读入内存并传给子进程
+        projection = {"name": 1, "history": 1, "latest_data": 1}
+        cursor = self.collection.find(query, projection, no_cursor_timeout=True).batch_size(200)
+        BATCH_SIZE = 500
         processed_count = 0
+        pending_docs: List[Dict] = []
+        invalid_codes: List[str] = []  # 8 开头的无效代码，扫描结束后一次性删除
 
-        for doc in cursor:
-            if self.status.should_stop:
-                self.status.finish("补全任务已终止")
-                return
+        try:
+            _warmup_derived_kernel()
+            with ProcessPoolExecutor(max_workers=RECALC_MAX_WORKERS) as pool:
+                for doc in cursor:
+                    if self.status.should_stop:
+                        self.status.finish("补全任务已终止")
+                        return
 
-            code = doc["_id"]
-            if str(code).startswith("8"): 
-                self.collection.delete_one({"_id": code})
-                continue
+                    code = doc["_id"]
+                    if str(code).startswith("8"): 
+                        invalid_codes.append(code)
+                        continue
 
+                    # 按批分发，保证内存中最多只有一批文档
+                    pending_docs.append(doc)
+                    if len(pending_docs) >= BATCH_SIZE:
+                        processed_count = self._recalculate_batch(pool, pending_docs, processed_count)
+                        pending_docs = []
+
+                if pending_docs:
+                    processed_count = self._recalculate_batch(pool, pending_docs, processed_count)
+            self.status.update(processed_count)
+        except Exception as e:
+            # 进程池异常 (子进程被 OOM 杀掉导致 BrokenProcessPool、序列化失败等) 也要结束任务状态，
+            # 否则 is_running 一直为 True，之后的爬虫/重算请求都会被拒绝
+            logger.error(f"❌ 全库重算失败: {e}")
+            self.status.finish(f"全库重算失败: {e}")
+            raise
+        finally:
+            cursor.close()
+            if invalid_codes:
+                self.collection.delete_many({"_id": {"$in": invalid_codes}})
+
+        self.status.finish("全库清洗重算完成")
+
+    def _recalculate_batch(self, pool: ProcessPoolExecutor, docs: List[Dict], processed_count: int) -> int:
+        """将一批文档交给进程池计算，并把结果批量写回，返回累计处理数"""
+        batch_ops: List[UpdateOne] = []
+        # 按块分发给子进程，减少逐文档的序列化/进程间通信往返 (每个进程约分到 4 块，兼顾负载均衡)
+        chunksize = max(1, len(docs) // (RECALC_MAX_WORKERS * 4))
+        for doc, res in zip(docs, pool.map(_worker_recalculate_stock, docs, chunksize=chunksize)):
             processed_count += 1
-            if processed_count % 10 == 0:
+            if self.status.should_report(processed_count):
                 self.status.update(processed_count, message=f"正在计算: {doc.get('name')}")
 
-            history = doc.get("history", [])
-            if not history: continue
-            
-            updated_history = []
-            latest_record = {}
-
-            for item in history:
-                # 修复数据类型
-                for k, v in item.items():
-                    if k in NUMERIC_FIELDS and isinstance(v, str):
-                        try: item[k] = float(v.replace(',', ''))
-                        except: pass 
-
-                def get_f(keys):
-                    for k in keys:
-                        val = item.get(k)
-                        if val is not None:
-                            try: return float(str(val).replace(',', ''))
-                            except: pass
-                    return None
-
-                # 获取基础数据
-                pe = get_f(['市盈率', 'PE'])
-                eps = get_f(['基本每股收益(元)', '基本每股收益'])
-                bvps = get_f(['每股净资产(元)', '每股净资产'])
-                growth = get_f(['净利润滚动环比增长(%)', '净利润环比增长'])
-                div_yield = get_f(['股息率TTM(%)', '股息率'])
-                ocf_ps = get_f(['每股经营现金流(元)', '每股经营现金流'])
-                roe = get_f(['股东权益回报率(%)', 'ROE'])
-                roa = get_f(['总资产回报率(%)', 'ROA'])
-                net_margin = get_f(['销售净利率(%)', '销售净利率'])
-
-                # 重新计算
-                if pe and pe > 0 and growth and growth != 0:
-                    item['PEG'] = round(pe / growth, 4)
-
-                if pe and pe > 0 and growth is not None and div_yield is not None:
-                    tr = growth + div_yield
-                    if tr > 0: item['PEGY'] = round(pe / tr, 4)
-                
-                # 使用 ValuationConfig 计算合理股价
-                if eps is not None and growth is not None:
-                    # 公式: EPS * (8.5 + 2 * g)
-                    multiplier = ValuationConfig.FAIR_PRICE_BASE + ValuationConfig.FAIR_PRICE_GROWTH_MULTIPLIER * growth
-                    fair_price = eps * multiplier
-                    if fair_price > 0:
-                        item['合理股价'] = round(fair_price, 2)
-                
-                if ocf_ps is not None and eps and eps > 0:
-                    item['净现比'] = round(ocf_ps / eps, 2)
-                
-                if pe and pe > 0 and eps and eps > 0 and ocf_ps and ocf_ps != 0:
-                    price = pe * eps
-                    item['市现率'] = round(price / ocf_ps, 2)
-
-                if roe is not None and roa and roa != 0:
-                    item['财务杠杆'] = round(roe / roa, 2)
-
-                if roa is not None and net_margin and net_margin != 0:
-                    item['总资产周转率'] = round(roa / net_margin, 2)
-
-                # 使用 ValuationConfig 计算格雷厄姆数
-                if eps is not None and bvps is not None:
-                    # 公式: Sqrt(22.5 * EPS * BVPS)
-                    val = ValuationConfig.GRAHAM_CONST * eps * bvps
-                    if val > 0:
-                        item['格雷厄姆数'] = round(math.sqrt(val), 2)
-                
-                updated_history.append(item)
-                latest_record = item
-
-            op = UpdateOne(
-                {"_id": code},
-                {"$set": {"history": updated_history, "latest_data": latest_record}}
-            )
-            batch_ops.append(op)
-
-            if len(batch_ops) >= BATCH_SIZE:
-                try: self.collection.bulk_write(batch_ops, ordered=False)
-                except Exception: pass
-                batch_ops = []
+            if res:
+                code, update_fields = res
+                update_fields["derived_version"] = DERIVED_VERSION
+                batch_ops.append(UpdateOne({"_id": code}, {"$set": update_fields}))
 
         if batch_ops:
-            try: self.collection.bulk_write(batch_ops, ordered=False)
-            except Exception: pass
+            self._flush_batch(batch_ops)
+        return processed_count
 
-        self.status.finish("全库清洗重算完成")
\ No newline at end of file
+    def _flush_batch(self, batch_ops: List[UpdateOne]):
+        """批量提交更新 (ordered=False: 单条失败不影响其余写入)"""
+        try:
+            self.collection.bulk_write(batch_ops, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            logger.warning(f"⚠️ 批量写入部分失败: {len(errors)}/{len(batch_ops)} 条")
+        except Exception as e:
+            logger.error(f"❌ 批量写入失败: {e}")
\ No newline at end of file
@@ -393,33 +393,41 @@ function stopTask() {
     });
 }
 
-setInterval(() => {
-    fetch('/api/status').then(res => res.json()).then(data => {
-        const container = document.getElementById('progress-container');
-        const stopBtn = document.getElementById('stopBtn');
-        const refreshBtn = document.getElementById('refreshBtn');
-        const recalcBtn = document.getElementById('recalcBtn');
-
-        if (data.is_running) {
-            container.style.display = 'block';
-            stopBtn.style.display = 'inline-block';
-            refreshBtn.disabled = true;
-            recalcBtn.disabled = true;
-            
-            const pct = data.total > 0 ? Math.round(data.current/data.total*100) : 0;
-            document.getElementById('progress-bar').style.width = pct + "%";
-            document.getElementById('progress-msg').innerText = `${data.message}`;
-        } else {
-            if (container.style.display === 'block') {
-                loadData(true);
-            }
-            container.style.display = 'none';
-            stopBtn.style.display = 'none';
-            refreshBtn.disabled = false;
-            recalcBtn.disabled = false;
+function renderStatus(data) {
+    const container = document.getElementById('progress-container');
+    const stopBtn = document.getElementById('stopBtn');
+    const refreshBtn = document.getElementById('refreshBtn');
+    const recalcBtn = document.getElementById('recalcBtn');
+
+    if (data.is_running) {
+        container.style.display = 'block';
+        stopBtn.style.display = 'inline-block';
+        refreshBtn.disabled = true;
+        recalcBtn.disabled = true;
+        
+        const pct = data.total > 0 ? Math.round(data.current/data.total*100) : 0;
+        document.getElementById('progress-bar').style.width = pct + "%";
+        document.getElementById('progress-msg').innerText = `${data.message}`;
+    } else {
+        if (container.style.display === 'block') {
+            loadData(true);
         }
-    });
-}, 1500);
+        container.style.display = 'none';
+        stopBtn.style.display = 'none';
+        refreshBtn.disabled = false;
+        recalcBtn.disabled = false;
+    }
+}
+
+// 任务状态: 优先使用 SSE 推送 (仅在状态变化时收到消息)，不支持时退回定时轮询
+if (window.EventSource) {
+    const statusSource = new EventSource('/api/status/stream');
+    statusSource.onmessage = (e) => renderStatus(JSON.parse(e.data));
+} else {
+    setInterval(() => {
+        fetch('/api/status').then(res => res.json()).then(renderStatus);
+    }, 1500);
+}
 
 // === 图表与模态框 ===
 var myChart = echarts.init(document.getElementById('chart-container'));
@@ -431,7 +439,7 @@ function loadChart(code, fieldKey, fieldLabel, suffix = '') {
     myChart.showLoading();
     document.getElementById('chartTitle').innerText = `加载中... - ${fieldLabel}`;
 
-    fetch(`/api/history/${code}`).then(res => res.json()).then(data => {
+    fetch(`/api/history/${code}?field=${encodeURIComponent(fieldKey)}`).then(res => res.json()).then(data => {
         myChart.hideLoading();
         document.getElementById('chartTitle').innerText = `${data.name} - ${fieldLabel} 历史趋势`;
         